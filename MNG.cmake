@@ -8,6 +8,23 @@ if(NOT DEFINED mng_source_cache)
 	set(mng_source_cache "${CMAKE_CURRENT_SOURCE_DIR}/deps" CACHE PATH "Directory to cache downloaded packages")
 endif()
 
+if(NOT DEFINED mng_update_interval)
+	set(mng_update_interval "300" CACHE STRING "Minimum seconds between remote checks of KEEP_UPDATED packages")
+endif()
+
+option(mng_report_timing "Print a per-package MNG timing summary at the end of configure" OFF)
+set(mng_timing_report "${CMAKE_BINARY_DIR}/_mng/timing.json" CACHE FILEPATH "JSON file receiving per-package MNG phase timings")
+
+if(NOT DEFINED mng_submodule_jobs)
+	set(mng_submodule_jobs "8" CACHE STRING "Number of submodules fetched in parallel")
+endif()
+
+option(mng_submodule_cache "Share submodule repositories between packages through local mirrors" OFF)
+
+if(NOT DEFINED mng_prebuilt_cache)
+	set(mng_prebuilt_cache "${mng_source_cache}/_prebuilt" CACHE PATH "Directory holding installed PREBUILT packages")
+endif()
+
 file(MAKE_DIRECTORY "${mng_source_cache}")
 
 set(_mng_impl_script "${CMAKE_CURRENT_LIST_DIR}/mng_impl.py")
@@ -34,6 +51,20 @@ function(_mng_run)
 	endif()
 endfunction()
 
+function(_mng_print_report)
+	# deferred calls run in the top-level directory scope, where _mng_impl_script may be unset
+	get_property(_mng_impl_script GLOBAL PROPERTY _mng_impl_script)
+	_mng_run("--cache-dir" "${mng_source_cache}" "--name" "dummy" "--report-file" "${mng_timing_report}" "--print-report")
+endfunction()
+
+get_property(_mng_report_deferred GLOBAL PROPERTY _mng_report_deferred)
+if(mng_report_timing AND NOT _mng_report_deferred)
+	set_property(GLOBAL PROPERTY _mng_report_deferred TRUE)
+	set_property(GLOBAL PROPERTY _mng_impl_script "${_mng_impl_script}")
+	file(REMOVE "${mng_timing_report}")
+	cmake_language(DEFER DIRECTORY "${CMAKE_SOURCE_DIR}" CALL _mng_print_report)
+endif()
+
 function(_mng_add_subdirectory p_name p_dir p_exclude p_system p_verbose)
 	set(build_dir "${CMAKE_BINARY_DIR}/_mng/${p_name}")
 
@@ -61,6 +92,132 @@ function(_mng_add_subdirectory p_name p_dir p_exclude p_system p_verbose)
 	set(CMAKE_MESSAGE_LOG_LEVEL "${mng_saved_verbose}")
 endfunction()
 
+function(_mng_prebuilt_key p_out p_name)
+	set(key_parts "${p_name}" ${ARGN})
+
+	set(meta_file "${mng_source_cache}/${p_name}/CACHE/.cache")
+	if(EXISTS "${meta_file}")
+		file(READ "${meta_file}" meta_json)
+		string(JSON git_head ERROR_VARIABLE json_err GET "${meta_json}" "git_head")
+		if(NOT json_err)
+			list(APPEND key_parts "git_head=${git_head}")
+		endif()
+	endif()
+
+	foreach(var
+		CMAKE_GENERATOR CMAKE_GENERATOR_PLATFORM CMAKE_GENERATOR_TOOLSET CMAKE_TOOLCHAIN_FILE
+		CMAKE_SYSTEM_NAME CMAKE_SYSTEM_PROCESSOR CMAKE_OSX_ARCHITECTURES CMAKE_OSX_SYSROOT
+		CMAKE_C_COMPILER CMAKE_C_COMPILER_ID CMAKE_C_COMPILER_VERSION CMAKE_C_FLAGS
+		CMAKE_CXX_COMPILER CMAKE_CXX_COMPILER_ID CMAKE_CXX_COMPILER_VERSION CMAKE_CXX_FLAGS
+		CMAKE_CXX_STANDARD CMAKE_POSITION_INDEPENDENT_CODE BUILD_SHARED_LIBS
+		CMAKE_BUILD_TYPE CMAKE_MAKE_PROGRAM
+	)
+		list(APPEND key_parts "${var}=${${var}}")
+	endforeach()
+
+	string(JOIN "\n" key_str ${key_parts})
+	string(SHA256 key_hash "${key_str}")
+	string(SUBSTRING "${key_hash}" 0 16 key_hash)
+	set(${p_out} "${key_hash}" PARENT_SCOPE)
+	set(${p_out}_TEXT "${key_str}" PARENT_SCOPE)
+endfunction()
+
+function(_mng_add_prebuilt p_name p_dir)
+	cmake_parse_arguments(pre "" "FIND_NAME;VERBOSE" "IDENTITY;OPTIONS;CMAKE_ARGS" ${ARGN})
+
+	if(NOT pre_FIND_NAME)
+		set(pre_FIND_NAME "${p_name}")
+	endif()
+
+	if(CMAKE_BUILD_TYPE)
+		set(build_type "${CMAKE_BUILD_TYPE}")
+	else()
+		set(build_type "Release")
+	endif()
+
+	set(define_args "-DCMAKE_BUILD_TYPE=${build_type}")
+	foreach(var CMAKE_TOOLCHAIN_FILE CMAKE_MAKE_PROGRAM CMAKE_C_COMPILER CMAKE_CXX_COMPILER CMAKE_C_FLAGS CMAKE_CXX_FLAGS
+		CMAKE_CXX_STANDARD CMAKE_POSITION_INDEPENDENT_CODE CMAKE_OSX_ARCHITECTURES CMAKE_OSX_SYSROOT BUILD_SHARED_LIBS)
+		if(DEFINED ${var} AND NOT "${${var}}" STREQUAL "")
+			list(APPEND define_args "-D${var}=${${var}}")
+		endif()
+	endforeach()
+
+	# earlier PREBUILT packages are only visible to this build through its prefix path
+	get_property(prebuilt_prefixes GLOBAL PROPERTY _mng_prebuilt_prefixes)
+	set(dep_prefixes ${prebuilt_prefixes} ${CMAKE_PREFIX_PATH})
+	if(dep_prefixes)
+		list(REMOVE_DUPLICATES dep_prefixes)
+		string(REPLACE ";" "\\;" dep_prefixes "${dep_prefixes}")
+		list(APPEND define_args "-DCMAKE_PREFIX_PATH=${dep_prefixes}")
+	endif()
+
+	foreach(opt ${pre_OPTIONS})
+		string(REPLACE " " ";" VALUE_LIST "${opt}")
+		list(GET VALUE_LIST 0 VALUE_NAME)
+		list(GET VALUE_LIST 1 VALUE_VALUE)
+		list(APPEND define_args "-D${VALUE_NAME}=${VALUE_VALUE}")
+	endforeach()
+	list(APPEND define_args ${pre_CMAKE_ARGS})
+
+	_mng_prebuilt_key(prebuilt_key "${p_name}" ${pre_IDENTITY} "${define_args}")
+
+	set(prefix "${mng_prebuilt_cache}/${p_name}/${prebuilt_key}")
+	set(stamp "${prefix}/.mng_installed")
+
+	if(NOT EXISTS "${stamp}")
+		file(MAKE_DIRECTORY "${mng_prebuilt_cache}/${p_name}")
+		file(LOCK "${prefix}.lock" GUARD FUNCTION TIMEOUT 7200)
+	endif()
+
+	if(NOT EXISTS "${stamp}")
+		message(STATUS "MNG: building ${p_name} into ${prefix}")
+
+		set(build_dir "${CMAKE_BINARY_DIR}/_mng_prebuilt/${p_name}")
+		file(REMOVE_RECURSE "${prefix}" "${build_dir}")
+
+		set(generator_args "-G" "${CMAKE_GENERATOR}")
+		if(CMAKE_GENERATOR_PLATFORM)
+			list(APPEND generator_args "-A" "${CMAKE_GENERATOR_PLATFORM}")
+		endif()
+		if(CMAKE_GENERATOR_TOOLSET)
+			list(APPEND generator_args "-T" "${CMAKE_GENERATOR_TOOLSET}")
+		endif()
+
+		if(pre_VERBOSE)
+			set(quiet_args "")
+		else()
+			set(quiet_args OUTPUT_VARIABLE build_log ERROR_VARIABLE build_log)
+		endif()
+
+		foreach(step configure build install)
+			if(step STREQUAL "configure")
+				set(step_cmd "${CMAKE_COMMAND}" -S "${p_dir}" -B "${build_dir}" ${generator_args}
+					"-DCMAKE_INSTALL_PREFIX=${prefix}")
+				# appended quoted so the escaped CMAKE_PREFIX_PATH separators survive
+				list(APPEND step_cmd "${define_args}")
+			elseif(step STREQUAL "build")
+				set(step_cmd "${CMAKE_COMMAND}" --build "${build_dir}" --config "${build_type}" --parallel)
+			else()
+				set(step_cmd "${CMAKE_COMMAND}" --install "${build_dir}" --config "${build_type}")
+			endif()
+
+			execute_process(COMMAND ${step_cmd} RESULT_VARIABLE step_result ${quiet_args})
+			if(NOT step_result EQUAL 0)
+				file(REMOVE_RECURSE "${prefix}")
+				message(FATAL_ERROR "MNG: ${step} of prebuilt ${p_name} failed (${step_result})\n${build_log}")
+			endif()
+		endforeach()
+
+		file(REMOVE_RECURSE "${build_dir}")
+		file(WRITE "${stamp}" "${prebuilt_key_TEXT}\n")
+	endif()
+
+	set_property(GLOBAL APPEND PROPERTY _mng_prebuilt_prefixes "${prefix}")
+	find_package(${pre_FIND_NAME} CONFIG REQUIRED GLOBAL PATHS "${prefix}" NO_DEFAULT_PATH)
+	set(${p_name}_PREBUILT_DIR "${prefix}" CACHE PATH "" FORCE)
+endfunction()
+
 function(mng_clear_cache)
 	cmake_parse_arguments(mng_clear "" "NAME" "" ${ARGN})
 
@@ -89,9 +246,17 @@ function(mng_clear_cache)
 	endif()
 endfunction()
 
+function(mng_export_bundle p_path)
+	_mng_run("--cache-dir" "${mng_source_cache}" "--name" "dummy" "--export-bundle" "${p_path}")
+endfunction()
+
+function(mng_import_bundle p_path)
+	_mng_run("--cache-dir" "${mng_source_cache}" "--name" "dummy" "--import-bundle" "${p_path}")
+endfunction()
+
 function(mng_add_package)
-	set(options EXCLUDE_FROM_ALL SYSTEM)
-	set(one_value_args NAME VERSION GIT_TAG GITHUB_REPOSITORY GIT_REPOSITORY URL DOWNLOAD_ONLY SUBDIRECTORY VERBOSE)
+	set(options EXCLUDE_FROM_ALL SYSTEM PARTIAL_CLONE PREBUILT)
+	set(one_value_args NAME VERSION GIT_TAG GITHUB_REPOSITORY GIT_REPOSITORY URL DOWNLOAD_ONLY SUBDIRECTORY VERBOSE FIND_PACKAGE_NAME)
 	set(multi_value_args OPTIONS CMAKE_ARGS)
 	cmake_parse_arguments(mng "${options}" "${one_value_args}" "${multi_value_args}" ${ARGN})
 
@@ -125,9 +290,25 @@ function(mng_add_package)
 		list(APPEND cmd_args "--url" "${mng_URL}")
 	endif()
 
+	if(mng_PARTIAL_CLONE)
+		list(APPEND cmd_args "--partial-clone")
+		if(mng_SUBDIRECTORY)
+			list(APPEND cmd_args "--sparse-dir" "${mng_SUBDIRECTORY}")
+		endif()
+	endif()
+
 	option(${mng_NAME}_KEEP_UPDATED "Keep ${mng_NAME} updated" OFF)
 	if(${mng_NAME}_KEEP_UPDATED)
-		list(APPEND cmd_args "--keep-updated")
+		list(APPEND cmd_args "--keep-updated" "--update-interval" "${mng_update_interval}")
+	endif()
+
+	list(APPEND cmd_args "--submodule-jobs" "${mng_submodule_jobs}")
+	if(mng_submodule_cache)
+		list(APPEND cmd_args "--submodule-cache")
+	endif()
+
+	if(mng_report_timing)
+		list(APPEND cmd_args "--report-file" "${mng_timing_report}")
 	endif()
 
 	if(mng_OPTIONS)
@@ -166,7 +347,23 @@ function(mng_add_package)
 			set(source_dir "${package_dir}")
 		endif()
 
-		_mng_add_subdirectory(${mng_NAME} "${source_dir}" ${mng_EXCLUDE_FROM_ALL} ${mng_SYSTEM} "${mng_VERBOSE}")
+		if(mng_PREBUILT)
+			if(mng_EXCLUDE_FROM_ALL OR mng_SYSTEM)
+				message(FATAL_ERROR "MNG: ${mng_NAME}: EXCLUDE_FROM_ALL and SYSTEM do not apply to PREBUILT packages")
+			endif()
+			_mng_add_prebuilt(${mng_NAME} "${source_dir}"
+				FIND_NAME "${mng_FIND_PACKAGE_NAME}"
+				VERBOSE "${mng_VERBOSE}"
+				IDENTITY
+					"version=${mng_VERSION}" "git_tag=${mng_GIT_TAG}"
+					"github_repository=${mng_GITHUB_REPOSITORY}" "git_repository=${mng_GIT_REPOSITORY}"
+					"url=${mng_URL}" "subdirectory=${mng_SUBDIRECTORY}"
+				OPTIONS ${mng_OPTIONS}
+				CMAKE_ARGS ${mng_CMAKE_ARGS}
+			)
+		else()
+			_mng_add_subdirectory(${mng_NAME} "${source_dir}" ${mng_EXCLUDE_FROM_ALL} ${mng_SYSTEM} "${mng_VERBOSE}")
+		endif()
 		SET(${mng_NAME}_SOURCE_DIR "${source_dir}" CACHE PATH "" FORCE)
 	else()
 		set(${mng_NAME}_SOURCE_DIR "${package_dir}" CACHE PATH "" FORCE)
@@ -2,6 +2,7 @@
 
 import argparse
 import concurrent.futures
+import contextlib
 import hashlib
 import json
 import os
@@ -13,10 +14,16 @@ import time
 import urllib.error
 import urllib.request
 import zipfile
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 from threading import Lock
 from typing import Dict, Optional, Tuple, List
 
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+	import msvcrt
+
 
 class logger:
 	def __init__(self, p_output=sys.stdout):
@@ -55,6 +62,170 @@ class logger:
 g_logger = logger()
 
 
+class file_lock:
+	POLL_T = 0.1
+
+	def __init__(self, p_path: Path, p_shared: bool = False):
+		self.m_path = p_path
+		self.m_shared = p_shared
+		self.m_file = None
+
+	def acquire(self) -> None:
+		self.m_path.parent.mkdir(parents=True, exist_ok=True)
+		self.m_file = open(self.m_path, 'a+b')
+
+		if fcntl is not None:
+			fcntl.flock(self.m_file.fileno(), fcntl.LOCK_SH if self.m_shared else fcntl.LOCK_EX)
+			return
+
+		# msvcrt has no shared locks, readers are serialized as well
+		while True:
+			try:
+				self.m_file.seek(0)
+				msvcrt.locking(self.m_file.fileno(), msvcrt.LK_NBLCK, 1)
+				return
+			except OSError:
+				time.sleep(file_lock.POLL_T)
+
+	def release(self) -> None:
+		if self.m_file is None:
+			return
+
+		if fcntl is not None:
+			fcntl.flock(self.m_file.fileno(), fcntl.LOCK_UN)
+		else:
+			self.m_file.seek(0)
+			msvcrt.locking(self.m_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+		self.m_file.close()
+		self.m_file = None
+
+	def __enter__(self):
+		self.acquire()
+		return self
+
+	def __exit__(self, p_type, p_value, p_tb):
+		self.release()
+
+
+class phase_timer:
+	def __init__(self):
+		self.m_lock = Lock()
+		self.m_report_file = None
+		self.m_name = None
+		self.m_status = None
+		self.m_start = 0.0
+		self.m_phases = []
+
+	def begin(self, p_name: str) -> None:
+		with self.m_lock:
+			self.m_name = p_name
+			self.m_status = None
+			self.m_start = time.perf_counter()
+			self.m_phases = []
+
+	def set_status(self, p_status: str) -> None:
+		self.m_status = p_status
+
+	@contextlib.contextmanager
+	def phase(self, p_phase: str):
+		record = {'phase': p_phase}
+		start = time.perf_counter()
+		try:
+			yield record
+		finally:
+			record['seconds'] = time.perf_counter() - start
+			self.set_bytes(record, record.get('bytes', 0))
+			with self.m_lock:
+				self.m_phases.append(record)
+
+	@staticmethod
+	def set_bytes(p_record: dict, p_bytes: int) -> None:
+		# bytes measured after the phase closed, so the measuring itself is not timed
+		if not p_bytes:
+			return
+		p_record['bytes'] = p_bytes
+		if p_record.get('seconds', 0) > 0:
+			p_record['mb_per_s'] = p_bytes / 1048576 / p_record['seconds']
+
+	def finish(self, p_success: bool) -> dict:
+		entry = {
+			'status': (self.m_status or 'done') if p_success else 'failed',
+			'seconds': time.perf_counter() - self.m_start,
+			'phases': list(self.m_phases)
+		}
+
+		if self.m_report_file and self.m_name:
+			self.write(self.m_report_file, self.m_name, entry)
+		return entry
+
+	@staticmethod
+	def write(p_path: Path, p_name: str, p_entry: dict) -> None:
+		with file_lock(p_path.with_name(p_path.name + ".lock")):
+			report = phase_timer.load(p_path)
+			report.setdefault('packages', {})[p_name] = p_entry
+
+			tmp_file = p_path.with_name(f"{p_path.name}.{os.getpid()}")
+			with open(tmp_file, 'w') as f:
+				json.dump(report, f, indent=2)
+			os.replace(tmp_file, p_path)
+
+	@staticmethod
+	def load(p_path: Path) -> dict:
+		if not p_path.exists():
+			return {}
+		try:
+			with open(p_path, 'r') as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return {}
+
+	@staticmethod
+	def print_report(p_path: Path) -> None:
+		packages = phase_timer.load(p_path).get('packages', {})
+		if not packages:
+			return
+
+		phase_names = []
+		for entry in packages.values():
+			for record in entry['phases']:
+				if record['phase'] not in phase_names:
+					phase_names.append(record['phase'])
+
+		name_w = max(len("package"), max(len(name) for name in packages))
+		header = f"{'package':<{name_w}}  {'status':<8} {'total':>8}"
+		header += ''.join(f" {name:>13}" for name in phase_names)
+		header += f" {'MB':>9} {'MB/s':>8} {'files':>7}"
+
+		print(f"-- MNG timing ({p_path})")
+		print(f"-- {header}")
+
+		total_t = 0.0
+		for name, entry in sorted(packages.items(), key=lambda item: -item[1]['seconds']):
+			sums = {}
+			xfer_bytes = 0
+			xfer_t = 0.0
+			files = 0
+			for record in entry['phases']:
+				sums[record['phase']] = sums.get(record['phase'], 0.0) + record['seconds']
+				if record.get('bytes'):
+					xfer_bytes += record['bytes']
+					xfer_t += record['seconds']
+				files += record.get('files', 0)
+
+			rate = f"{xfer_bytes / 1048576 / xfer_t:8.2f}" if xfer_t > 0 else f"{'-':>8}"
+			line = f"{name:<{name_w}}  {entry['status']:<8} {entry['seconds']:7.2f}s"
+			line += ''.join(f" {sums[ph]:12.2f}s" if ph in sums else f" {'-':>13}" for ph in phase_names)
+			line += f" {xfer_bytes / 1048576:9.2f} {rate} {files:7d}"
+			print(f"-- {line}")
+			total_t += entry['seconds']
+
+		print(f"-- {len(packages)} packages, {total_t:.2f}s total")
+
+
+g_timer = phase_timer()
+
+
 class dl_helper:
 	CHUNK_SZ = 131072
 	TIMEOUT = 30
@@ -111,13 +282,16 @@ class dl_helper:
 
 
 class pkg_cache:
+	IDENTITY_KEYS = ('version', 'git_tag', 'github_repository', 'git_repository', 'url', 'sparse_dir')
+
 	def __init__(self, p_cache_dir: Path):
 		self.m_cache_dir = p_cache_dir
 		self.m_cache_lock = Lock()
 		self.m_meta_cache = {}
 
 	def get_pkg_hash(self, p_info: dict) -> str:
-		hash_data = json.dumps(p_info, sort_keys=True)
+		identity = {key: p_info.get(key, '') for key in pkg_cache.IDENTITY_KEYS}
+		hash_data = json.dumps(identity, sort_keys=True)
 		return hashlib.sha256(hash_data.encode()).hexdigest()[:16]
 
 	def is_valid(self, p_name: str, p_info: dict, p_pkg_dir: Path) -> bool:
@@ -138,45 +312,209 @@ class pkg_cache:
 
 		return self.get_pkg_hash(cached_info) == self.get_pkg_hash(p_info)
 
+	def forget(self, p_name: str) -> None:
+		with self.m_cache_lock:
+			self.m_meta_cache.pop(p_name, None)
+
 
 class git_helper:
+	def __init__(self, p_jobs: int = 8, p_sub_cache: Optional['submodule_cache'] = None):
+		self.m_jobs = p_jobs
+		self.m_sub_cache = p_sub_cache
+
 	@staticmethod
-	def full_clone(p_repo: str, p_dest: Path, p_tag: Optional[str] = None) -> bool:
+	def get_env() -> dict:
+		env = os.environ.copy()
+		env['GIT_HTTP_LOW_SPEED_LIMIT'] = '1000'
+		env['GIT_HTTP_LOW_SPEED_TIME'] = '10'
+		return env
+
+	def full_clone(self, p_repo: str, p_dest: Path, p_tag: Optional[str] = None,
+				   p_partial: bool = False, p_sparse_dir: Optional[str] = None) -> bool:
 		g_logger.info(f"Cloning: {p_repo}")
 		if p_tag:
 			g_logger.info(f"Tag: {p_tag}")
 
+		if p_partial:
+			return self.partial_clone(p_repo, p_dest, p_tag, p_sparse_dir)
+
 		cmd = ['git', 'clone']
 
 		if p_tag:
 			cmd.extend(['--branch', p_tag])
 
+		if self.m_sub_cache is None:
+			cmd.extend([
+				'--recurse-submodules',
+				'--shallow-submodules',
+				'--jobs', str(self.m_jobs)
+			])
+
 		cmd.extend([
-			'--recurse-submodules',
 			'--quiet',
-			'--shallow-submodules',
 			'--single-branch',
 			'--depth', '1',
 			p_repo,
 			str(p_dest)
 		])
 
-		env = os.environ.copy()
-		env['GIT_HTTP_LOW_SPEED_LIMIT'] = '1000'
-		env['GIT_HTTP_LOW_SPEED_TIME'] = '10'
-
 		g_logger.info(f"Exec: {' '.join(cmd)}")
-		result = subprocess.run(cmd, capture_output=True, text=True, env=env, timeout=600)
+		result = subprocess.run(cmd, capture_output=True, text=True, env=git_helper.get_env(), timeout=600)
 
-		if result.returncode == 0:
-			g_logger.info("Clone success")
-			return True
+		if result.returncode != 0:
+			g_logger.error(f"Clone failed: {result.stderr}")
+			return False
 
-		g_logger.error(f"Clone failed: {result.stderr}")
-		return False
+		if self.m_sub_cache is not None and not self.m_sub_cache.sync(p_dest):
+			g_logger.error("Submodule sync failed")
+			return False
+
+		g_logger.info("Clone success")
+		return True
+
+	def partial_clone(self, p_repo: str, p_dest: Path, p_tag: Optional[str] = None,
+					  p_sparse_dir: Optional[str] = None) -> bool:
+		env = git_helper.get_env()
+		cmd = ['git', 'clone']
+
+		if p_tag:
+			cmd.extend(['--branch', p_tag])
+
+		cmd.extend([
+			'--filter=blob:none',
+			'--quiet',
+			'--single-branch',
+			'--depth', '1'
+		])
+
+		if p_sparse_dir:
+			g_logger.info(f"Sparse: {p_sparse_dir}")
+			cmd.append('--sparse')
+
+		cmd.extend([p_repo, str(p_dest)])
+
+		try:
+			g_logger.info(f"Exec: {' '.join(cmd)}")
+			subprocess.run(cmd, capture_output=True, text=True, env=env, check=True, timeout=600)
+
+			if p_sparse_dir:
+				cone = [p_sparse_dir]
+				if git_helper.is_gitlink(p_dest, p_sparse_dir):
+					# cone mode only accepts directories; the parent cone keeps the gitlink
+					parent = PurePosixPath(p_sparse_dir.strip('/')).parent.as_posix()
+					cone = [] if parent == '.' else [parent]
+				subprocess.run(
+					['git', 'sparse-checkout', 'set', '--cone', '--'] + cone,
+					cwd=p_dest, capture_output=True, text=True, env=env, check=True, timeout=600
+				)
+
+			if self.m_sub_cache is not None:
+				if not self.m_sub_cache.sync(p_dest, p_sparse_dir):
+					g_logger.error("Submodule sync failed")
+					return False
+			else:
+				subprocess.run(
+					self.submodule_cmd(p_sparse_dir, p_shallow=True),
+					cwd=p_dest, capture_output=True, text=True, env=env, check=True, timeout=600
+				)
+		except subprocess.CalledProcessError as e:
+			g_logger.error(f"Clone failed: {e.stderr}")
+			return False
+		except subprocess.TimeoutExpired as e:
+			g_logger.error(f"Clone failed: {e}")
+			return False
+
+		g_logger.info("Clone success")
+		return True
+
+	@staticmethod
+	def is_gitlink(p_dest: Path, p_path: str) -> bool:
+		result = subprocess.run(
+			['git', 'ls-tree', 'HEAD', '--', p_path.strip('/')],
+			cwd=p_dest, capture_output=True, text=True, timeout=30
+		)
+		return result.returncode == 0 and result.stdout.startswith('160000 ')
+
+	def submodule_cmd(self, p_sparse_dir: Optional[str] = None, p_shallow: bool = False) -> List[str]:
+		cmd = ['git', 'submodule', 'update', '--init', '--recursive', '--quiet', '--jobs', str(self.m_jobs)]
+		if p_shallow:
+			cmd.extend(['--depth', '1'])
+		if p_sparse_dir:
+			cmd.extend(['--', p_sparse_dir])
+		return cmd
+
+	@staticmethod
+	def local_head(p_dest: Path) -> Optional[str]:
+		result = subprocess.run(
+			['git', 'rev-parse', 'HEAD'],
+			cwd=p_dest, capture_output=True, text=True, timeout=30
+		)
+		if result.returncode != 0:
+			return None
+		return result.stdout.strip() or None
 
 	@staticmethod
-	def update_full(p_dest: Path) -> bool:
+	def remote_head(p_dest: Path, p_ref: Optional[str] = None) -> Optional[str]:
+		# pinned clones track their tag or branch; the peeled tag comes first so annotated tags match HEAD
+		if p_ref:
+			refs = [f"refs/tags/{p_ref}^{{}}", f"refs/tags/{p_ref}", f"refs/heads/{p_ref}"]
+		else:
+			refs = ['HEAD']
+
+		try:
+			result = subprocess.run(
+				['git', 'ls-remote', '--quiet', 'origin'] + refs,
+				cwd=p_dest, capture_output=True, text=True, timeout=60
+			)
+		except subprocess.TimeoutExpired as e:
+			g_logger.error(f"ls-remote failed: {e}")
+			return None
+
+		if result.returncode != 0:
+			g_logger.error(f"ls-remote failed: {result.stderr}")
+			return None
+
+		found = {}
+		for line in result.stdout.splitlines():
+			parts = line.split()
+			if len(parts) == 2:
+				found[parts[1]] = parts[0]
+
+		for ref in refs:
+			if ref in found:
+				return found[ref]
+		return None
+
+	@staticmethod
+	def pack_size(p_dest: Path) -> int:
+		total = git_helper.object_size(p_dest)
+		result = subprocess.run(
+			['git', 'submodule', 'foreach', '--recursive', '--quiet', 'pwd'],
+			cwd=p_dest, capture_output=True, text=True, timeout=60
+		)
+		if result.returncode == 0:
+			for line in result.stdout.splitlines():
+				if line.strip():
+					total += git_helper.object_size(Path(line.strip()))
+		return total
+
+	@staticmethod
+	def object_size(p_dest: Path) -> int:
+		result = subprocess.run(
+			['git', 'count-objects', '-v'],
+			cwd=p_dest, capture_output=True, text=True, timeout=30
+		)
+		if result.returncode != 0:
+			return 0
+
+		size_kb = 0
+		for line in result.stdout.splitlines():
+			key, _, value = line.partition(':')
+			if key in ('size', 'size-pack'):
+				size_kb += int(value.strip() or 0)
+		return size_kb * 1024
+
+	def update_full(self, p_dest: Path, p_sparse_dir: Optional[str] = None) -> bool:
 		try:
 			g_logger.info(f"Updating: {p_dest}")
 
@@ -193,10 +531,15 @@ class git_helper:
 			)
 
 			g_logger.info("Updating submodules...")
-			subprocess.run(
-				['git', 'submodule', 'update', '--init', '--recursive', '--quiet'],
-				cwd=p_dest, check=False, timeout=120
-			)
+			if self.m_sub_cache is not None:
+				if not self.m_sub_cache.sync(p_dest, p_sparse_dir):
+					g_logger.error("Submodule sync failed")
+					return False
+			else:
+				subprocess.run(
+					self.submodule_cmd(p_sparse_dir),
+					cwd=p_dest, check=False, timeout=120
+				)
 
 			g_logger.info("Update success")
 			return True
@@ -205,13 +548,129 @@ class git_helper:
 			return False
 
 
+class submodule_cache:
+	def __init__(self, p_root: Path, p_jobs: int = 8):
+		self.m_root = p_root.resolve()
+		self.m_jobs = p_jobs
+
+	def get_mirror(self, p_url: str) -> Path:
+		return self.m_root / f"{hashlib.sha256(p_url.encode()).hexdigest()[:16]}.git"
+
+	@staticmethod
+	def git(p_args: List[str], p_cwd: Path, p_timeout: int = 600) -> subprocess.CompletedProcess:
+		return subprocess.run(
+			['git'] + p_args, cwd=p_cwd, capture_output=True, text=True,
+			env=git_helper.get_env(), timeout=p_timeout
+		)
+
+	@staticmethod
+	def has_commit(p_mirror: Path, p_sha: str) -> bool:
+		return submodule_cache.git(['cat-file', '-e', f"{p_sha}^{{commit}}"], p_mirror, 30).returncode == 0
+
+	def ensure(self, p_url: str, p_sha: str) -> Optional[Path]:
+		mirror = self.get_mirror(p_url)
+
+		with file_lock(mirror.with_suffix('.lock')):
+			if not mirror.exists():
+				result = self.git(['init', '--bare', '--quiet', str(mirror)], self.m_root, 60)
+				if result.returncode != 0:
+					g_logger.error(f"Submodule mirror init failed: {result.stderr}")
+					return None
+				self.git(['config', 'uploadpack.allowAnySHA1InWant', 'true'], mirror)
+				self.git(['config', 'mng.url', p_url], mirror)
+
+			if self.has_commit(mirror, p_sha):
+				g_logger.info(f"Submodule cached: {p_url}@{p_sha[:12]}")
+				return mirror
+
+			g_logger.info(f"Submodule fetch: {p_url}@{p_sha[:12]}")
+			result = self.git(['fetch', '--quiet', '--depth', '1', p_url, p_sha], mirror)
+			if result.returncode != 0 or not self.has_commit(mirror, p_sha):
+				# the remote refuses unadvertised shas; deepen its HEAD until the commit is reachable
+				for depth_args in (['--depth', '64'], ['--deepen', '512'], ['--deepen', '4096']):
+					self.git(['fetch', '--quiet'] + depth_args + [p_url, 'HEAD'], mirror)
+					if self.has_commit(mirror, p_sha):
+						break
+
+			if not self.has_commit(mirror, p_sha):
+				g_logger.error(f"Submodule commit missing: {p_url}@{p_sha}")
+				return None
+
+			self.git(['update-ref', f"refs/mng/{p_sha}", p_sha], mirror)
+			return mirror
+
+	def list_submodules(self, p_dest: Path, p_sparse_dir: Optional[str] = None) -> List[Tuple[str, str, str, str]]:
+		pathspec = ['--', p_sparse_dir] if p_sparse_dir else []
+
+		names = {}
+		result = self.git(['config', '-f', '.gitmodules', '--get-regexp', r'^submodule\..*\.path$'], p_dest, 30)
+		for line in result.stdout.splitlines():
+			key, _, path = line.partition(' ')
+			names[path] = key[len('submodule.'):-len('.path')]
+
+		entries = []
+		result = self.git(['ls-files', '-s'] + pathspec, p_dest, 30)
+		for line in result.stdout.splitlines():
+			meta, _, path = line.partition('\t')
+			parts = meta.split()
+			if len(parts) != 3 or parts[0] != '160000' or path not in names:
+				continue
+
+			name = names[path]
+			url = self.git(['config', '--get', f"submodule.{name}.url"], p_dest, 30).stdout.strip()
+			if url:
+				entries.append((name, path, parts[1], url))
+		return entries
+
+	def sync(self, p_dest: Path, p_sparse_dir: Optional[str] = None) -> bool:
+		if not (p_dest / '.gitmodules').exists():
+			return True
+
+		pathspec = ['--', p_sparse_dir] if p_sparse_dir else []
+		self.git(['submodule', 'init', '--quiet'] + pathspec, p_dest, 60)
+
+		entries = self.list_submodules(p_dest, p_sparse_dir)
+		if not entries:
+			return True
+
+		with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.m_jobs)) as pool:
+			mirrors = list(pool.map(lambda entry: self.ensure(entry[3], entry[2]), entries))
+
+		if any(mirror is None for mirror in mirrors):
+			return False
+
+		# point submodules at the local mirrors for checkout, then restore the real remotes
+		try:
+			for (name, path, _, _), mirror in zip(entries, mirrors):
+				self.git(['config', f"submodule.{name}.url", str(mirror)], p_dest, 30)
+				if (p_dest / path / '.git').exists():
+					self.git(['remote', 'set-url', 'origin', str(mirror)], p_dest / path, 30)
+
+			result = self.git(
+				['-c', 'protocol.file.allow=always', 'submodule', 'update', '--quiet',
+				 '--jobs', str(self.m_jobs), '--'] + [entry[1] for entry in entries],
+				p_dest
+			)
+			if result.returncode != 0:
+				g_logger.error(f"Submodule update failed: {result.stderr}")
+				return False
+		finally:
+			for name, path, _, url in entries:
+				self.git(['config', f"submodule.{name}.url", url], p_dest, 30)
+				if (p_dest / path / '.git').exists():
+					self.git(['remote', 'set-url', 'origin', url], p_dest / path, 30)
+
+		return all(self.sync(p_dest / entry[1]) for entry in entries)
+
+
 class pkg_mgr:
-	def __init__(self, p_cache_dir):
+	def __init__(self, p_cache_dir, p_submodule_jobs: int = 8, p_submodule_cache: bool = False):
 		self.m_cache_dir = Path(p_cache_dir)
 		self.m_cache_dir.mkdir(parents=True, exist_ok=True)
 		self.m_cache = pkg_cache(self.m_cache_dir)
 		self.m_dl_helper = dl_helper()
-		self.m_git_helper = git_helper()
+		sub_cache = submodule_cache(self.m_cache_dir / ".submodules", p_submodule_jobs) if p_submodule_cache else None
+		self.m_git_helper = git_helper(p_submodule_jobs, sub_cache)
 		self.m_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
 
 	def get_cache_file(self, p_name: str) -> Path:
@@ -222,6 +681,23 @@ class pkg_mgr:
 	def get_pkg_dir(self, p_name: str) -> Path:
 		return self.m_cache_dir / p_name / p_name
 
+	def get_lock_file(self, p_name: str) -> Path:
+		return self.m_cache_dir / ".locks" / f"{p_name}.lock"
+
+	def get_staging_dir(self, p_name: str) -> Path:
+		return self.m_cache_dir / p_name / f".staging-{os.getpid()}"
+
+	def clear_staging(self, p_name: str) -> None:
+		pkg_parent = self.m_cache_dir / p_name
+		if not pkg_parent.exists():
+			return
+		for stale in pkg_parent.glob(".staging-*"):
+			g_logger.info(f"Remove stale: {stale}")
+			shutil.rmtree(stale, ignore_errors=True)
+
+	def commit_staging(self, p_name: str, p_staging: Path) -> None:
+		os.replace(p_staging, self.get_pkg_dir(p_name))
+
 	def load_cached_info(self, p_name: str) -> dict:
 		cache_file = self.get_cache_file(p_name)
 		if cache_file.exists():
@@ -231,8 +707,10 @@ class pkg_mgr:
 
 	def save_cached_info(self, p_name: str, p_info: dict) -> None:
 		cache_file = self.get_cache_file(p_name)
-		with open(cache_file, 'w') as f:
+		tmp_file = cache_file.with_name(f".cache.{os.getpid()}")
+		with open(tmp_file, 'w') as f:
 			json.dump(p_info, f, indent=2)
+		os.replace(tmp_file, cache_file)
 
 	def needs_refetch(self, p_name: str, p_new_info: dict) -> bool:
 		pkg_dir = self.get_pkg_dir(p_name)
@@ -243,26 +721,69 @@ class pkg_mgr:
 		pkg_parent = self.m_cache_dir / p_name
 		if pkg_parent.exists():
 			shutil.rmtree(pkg_parent)
-			if p_name in self.m_cache.m_meta_cache:
-				del self.m_cache.m_meta_cache[p_name]
+			self.m_cache.forget(p_name)
 			g_logger.info(f"Cleared: {p_name}")
 		else:
 			g_logger.info(f"Not found: {p_name}")
 
-	def clone_repo(self, p_name: str, p_repo: str, p_tag: Optional[str] = None) -> bool:
-		pkg_dir = self.get_pkg_dir(p_name)
-		pkg_dir.parent.mkdir(parents=True, exist_ok=True)
+	def clone_repo(self, p_name: str, p_repo: str, p_tag: Optional[str] = None,
+				   p_partial: bool = False, p_sparse_dir: Optional[str] = None) -> bool:
+		staging_dir = self.get_staging_dir(p_name)
+		staging_dir.parent.mkdir(parents=True, exist_ok=True)
 
 		g_logger.info(f"Clone start: {p_name}")
-		return self.m_git_helper.full_clone(p_repo, pkg_dir, p_tag)
+		with g_timer.phase('clone') as record:
+			if not self.m_git_helper.full_clone(p_repo, staging_dir, p_tag, p_partial, p_sparse_dir):
+				shutil.rmtree(staging_dir, ignore_errors=True)
+				return False
+
+		if g_timer.m_report_file:
+			g_timer.set_bytes(record, self.m_git_helper.pack_size(staging_dir))
+
+		self.commit_staging(p_name, staging_dir)
+		return True
+
+	@staticmethod
+	def get_git_ref(p_tag: Optional[str], p_version: Optional[str]) -> Optional[str]:
+		return p_tag or (f"v{p_version}" if p_version else None)
 
-	def update_repo(self, p_name: str) -> bool:
+	def update_repo(self, p_name: str, p_interval: int = 0) -> bool:
 		pkg_dir = self.get_pkg_dir(p_name)
 		if not pkg_dir.exists():
 			return False
-		return self.m_git_helper.update_full(pkg_dir)
 
-	def extract_zip(self, p_file: Path, p_pkg_dir: Path) -> None:
+		cached_info = self.load_cached_info(p_name)
+		now = time.time()
+
+		last_check = cached_info.get('last_check', 0)
+		if p_interval > 0 and now - last_check < p_interval:
+			g_logger.info(f"Checked {int(now - last_check)}s ago, skip")
+			return True
+
+		size_before = self.m_git_helper.pack_size(pkg_dir) if g_timer.m_report_file else 0
+		updated = False
+		with g_timer.phase('fetch') as record:
+			local_head = cached_info.get('git_head') or self.m_git_helper.local_head(pkg_dir)
+			git_ref = self.get_git_ref(cached_info.get('git_tag'), cached_info.get('version'))
+			remote_head = self.m_git_helper.remote_head(pkg_dir, git_ref)
+
+			if local_head and remote_head == local_head:
+				g_logger.info(f"Up to date: {local_head[:12]}")
+			else:
+				if not self.m_git_helper.update_full(pkg_dir, cached_info.get('sparse_dir') or None):
+					return False
+				local_head = self.m_git_helper.local_head(pkg_dir)
+				updated = True
+
+		if updated and g_timer.m_report_file:
+			g_timer.set_bytes(record, max(0, self.m_git_helper.pack_size(pkg_dir) - size_before))
+
+		cached_info['git_head'] = local_head or ''
+		cached_info['last_check'] = now
+		self.save_cached_info(p_name, cached_info)
+		return True
+
+	def extract_zip(self, p_file: Path, p_pkg_dir: Path) -> int:
 		g_logger.info("Extracting ZIP")
 		with zipfile.ZipFile(p_file, 'r') as zip_ref:
 			members = zip_ref.namelist()
@@ -285,7 +806,9 @@ class pkg_mgr:
 			else:
 				zip_ref.extractall(p_pkg_dir)
 
-	def extract_tar(self, p_file: Path, p_pkg_dir: Path) -> None:
+		return len(members)
+
+	def extract_tar(self, p_file: Path, p_pkg_dir: Path) -> int:
 		g_logger.info("Extracting TAR")
 		with tarfile.open(p_file, 'r:*') as tar_ref:
 			members = tar_ref.getmembers()
@@ -304,31 +827,52 @@ class pkg_mgr:
 			else:
 				tar_ref.extractall(p_pkg_dir)
 
+		return len(members)
+
 	def dl_archive(self, p_name: str, p_url: str) -> bool:
-		pkg_dir = self.get_pkg_dir(p_name)
-		pkg_dir.parent.mkdir(parents=True, exist_ok=True)
+		staging_dir = self.get_staging_dir(p_name)
+		staging_dir.mkdir(parents=True, exist_ok=True)
 
 		g_logger.info(f"DL archive: {p_name}")
-		dl_file = self.m_cache_dir / f"{p_name}_dl"
+		dl_file = staging_dir.with_name(f".download-{os.getpid()}")
 
-		if not self.m_dl_helper.dl_with_retry(p_url, dl_file):
-			return False
+		with g_timer.phase('download') as record:
+			if not self.m_dl_helper.dl_with_retry(p_url, dl_file):
+				dl_file.unlink(missing_ok=True)
+				shutil.rmtree(staging_dir, ignore_errors=True)
+				return False
+			record['bytes'] = dl_file.stat().st_size
 
+		success = False
 		try:
 			g_logger.info(f"Extract: {p_name}")
 
-			if p_url.endswith('.zip'):
-				self.extract_zip(dl_file, pkg_dir)
-			else:
-				self.extract_tar(dl_file, pkg_dir)
+			with g_timer.phase('extract') as record:
+				if p_url.endswith('.zip'):
+					record['files'] = self.extract_zip(dl_file, staging_dir)
+				else:
+					record['files'] = self.extract_tar(dl_file, staging_dir)
 
+			self.commit_staging(p_name, staging_dir)
 			g_logger.info(f"Extract done: {p_name}")
+			success = True
 			return True
 		finally:
 			dl_file.unlink(missing_ok=True)
+			if not success:
+				shutil.rmtree(staging_dir, ignore_errors=True)
 			g_logger.info("Cleanup done")
 
 	def process_pkg(self, p_args) -> bool:
+		g_timer.begin(p_args.name)
+		success = False
+		try:
+			success = self.resolve_pkg(p_args)
+			return success
+		finally:
+			g_timer.finish(success)
+
+	def resolve_pkg(self, p_args) -> bool:
 		name = p_args.name
 		pkg_dir = self.get_pkg_dir(name)
 
@@ -342,30 +886,64 @@ class pkg_mgr:
 			'url': p_args.url or ''
 		}
 
+		if p_args.partial_clone and p_args.sparse_dir:
+			new_info['sparse_dir'] = p_args.sparse_dir
+
 		if p_args.version:
 			g_logger.info(f"Version: {p_args.version}")
 		if p_args.git_tag:
 			g_logger.info(f"Tag: {p_args.git_tag}")
 
+		is_git = bool(p_args.git_repository or p_args.github_repository)
+		lock_file = self.get_lock_file(name)
+
 		g_logger.info("Check cache")
-		if pkg_dir.exists() and self.needs_refetch(name, new_info):
-			g_logger.status("REFETCH", name)
-			self.clear_pkg(name)
+		if not (p_args.keep_updated and is_git):
+			with g_timer.phase('cache_check'), file_lock(lock_file, p_shared=True):
+				if pkg_dir.exists() and not self.needs_refetch(name, new_info):
+					g_logger.status("CACHED", name)
+					g_logger.info("Using cache")
+					g_logger.status("EXISTS", str(pkg_dir))
+					g_timer.set_status('cached')
+					return True
+
+		with g_timer.phase('lock_wait'):
+			pkg_lock = file_lock(lock_file)
+			pkg_lock.acquire()
+
+		try:
+			self.m_cache.forget(name)
+			return self.fetch_pkg(p_args, new_info)
+		finally:
+			pkg_lock.release()
+
+	def fetch_pkg(self, p_args, p_new_info: dict) -> bool:
+		name = p_args.name
+		pkg_dir = self.get_pkg_dir(name)
+
+		with g_timer.phase('cache_check'):
+			self.clear_staging(name)
+
+			if pkg_dir.exists() and self.needs_refetch(name, p_new_info):
+				g_logger.status("REFETCH", name)
+				self.clear_pkg(name)
 
 		if pkg_dir.exists():
 			if p_args.keep_updated and (p_args.git_repository or p_args.github_repository):
 				g_logger.status("UPDATE", name)
 				g_logger.info("Update existing")
-				if not self.update_repo(name):
+				if not self.update_repo(name, p_args.update_interval):
 					g_logger.info("Update failed, refetch")
 					self.clear_pkg(name)
 				else:
 					g_logger.status("EXISTS", str(pkg_dir))
+					g_timer.set_status('updated')
 					return True
 			else:
 				g_logger.status("CACHED", name)
 				g_logger.info("Using cache")
 				g_logger.status("EXISTS", str(pkg_dir))
+				g_timer.set_status('cached')
 				return True
 
 		g_logger.info("Not cached, download")
@@ -380,8 +958,8 @@ class pkg_mgr:
 
 		success = False
 		if git_repo:
-			git_tag = p_args.git_tag or (f"v{p_args.version}" if p_args.version else None)
-			success = self.clone_repo(name, git_repo, git_tag)
+			git_tag = self.get_git_ref(p_args.git_tag, p_args.version)
+			success = self.clone_repo(name, git_repo, git_tag, p_args.partial_clone, p_new_info.get('sparse_dir'))
 		elif p_args.url:
 			g_logger.info(f"URL: {p_args.url}")
 			success = self.dl_archive(name, p_args.url)
@@ -392,17 +970,175 @@ class pkg_mgr:
 		if not success:
 			return False
 
+		if git_repo:
+			p_new_info['git_head'] = self.m_git_helper.local_head(pkg_dir) or ''
+			p_new_info['last_check'] = time.time()
+
 		g_logger.info("Save metadata")
-		self.save_cached_info(name, new_info)
+		with g_timer.phase('metadata_save'):
+			self.save_cached_info(name, p_new_info)
+		g_timer.set_status('fetched')
 		g_logger.success(str(pkg_dir))
 		return True
 
+	def list_cached_pkgs(self) -> List[str]:
+		names = []
+		for entry in sorted(self.m_cache_dir.iterdir()):
+			if entry.name.startswith('.') or not entry.is_dir():
+				continue
+			if (entry / "CACHE" / ".cache").exists() and self.get_pkg_dir(entry.name).is_dir():
+				names.append(entry.name)
+		return names
+
+	def export_bundle(self, p_bundle: Path) -> int:
+		mode = 'w|gz'
+		if p_bundle.name.endswith('.xz'):
+			mode = 'w|xz'
+		elif p_bundle.name.endswith('.bz2'):
+			mode = 'w|bz2'
+
+		digests = {}
+		dedup_bytes = 0
+		names = self.list_cached_pkgs()
+
+		with contextlib.ExitStack() as locks:
+			# validate every package before the archive exists, so a bad tree leaves nothing behind
+			pkg_paths = {}
+			for name in names:
+				locks.enter_context(file_lock(self.get_lock_file(name), p_shared=True))
+				pkg_paths[name] = self.collect_bundle_paths(name)
+
+			with tarfile.open(str(p_bundle), mode) as tar_ref:
+				for name in names:
+					g_logger.info(f"Export: {name}")
+					for path in pkg_paths[name]:
+						arcname = path.relative_to(self.m_cache_dir).as_posix()
+						info = tar_ref.gettarinfo(str(path), arcname)
+
+						if not info.isfile():
+							tar_ref.addfile(info)
+							continue
+
+						hasher = hashlib.sha256()
+						with open(path, 'rb') as f:
+							for chunk in iter(lambda: f.read(dl_helper.CHUNK_SZ), b''):
+								hasher.update(chunk)
+						digest = (hasher.hexdigest(), info.mode)
+
+						if digest in digests:
+							dedup_bytes += info.size
+							info.type = tarfile.LNKTYPE
+							info.linkname = digests[digest]
+							info.size = 0
+							tar_ref.addfile(info)
+							continue
+
+						digests[digest] = arcname
+						with open(path, 'rb') as f:
+							tar_ref.addfile(info, f)
+
+		g_logger.info(f"Deduplicated: {dedup_bytes / 1048576:.2f} MB")
+		g_logger.success(f"Exported {len(names)} packages: {p_bundle}")
+		return len(names)
+
+	def collect_bundle_paths(self, p_name: str) -> List[Path]:
+		pkg_parent = self.m_cache_dir / p_name
+		paths = [pkg_parent, pkg_parent / p_name]
+		for root, dirs, files in os.walk(pkg_parent / p_name):
+			dirs.sort()
+			for entry in dirs + sorted(files):
+				paths.append(Path(root) / entry)
+		paths.extend([pkg_parent / "CACHE", pkg_parent / "CACHE" / ".cache"])
+
+		for path in paths:
+			name = path.relative_to(self.m_cache_dir).as_posix()
+			if path.is_symlink():
+				self.check_bundle_symlink(name, os.readlink(path))
+			elif not (path.is_file() or path.is_dir()):
+				raise ValueError(f"Unsupported file type for bundle: {path}")
+		return paths
+
+	@staticmethod
+	def check_bundle_symlink(p_name: str, p_linkname: str) -> None:
+		if os.path.isabs(p_linkname):
+			raise ValueError(f"Absolute symlink in bundle: {p_name} -> {p_linkname}")
+
+		pkg_name = Path(p_name).parts[0]
+		resolved = os.path.normpath(os.path.join(os.path.dirname(p_name), p_linkname))
+		if Path(resolved).parts[:1] != (pkg_name,):
+			raise ValueError(f"Symlink escapes package in bundle: {p_name} -> {p_linkname}")
+
+	@staticmethod
+	def check_bundle_path(p_root: Path, p_name: str) -> Path:
+		parts = Path(p_name).parts
+		if not parts or os.path.isabs(p_name) or '..' in parts:
+			raise ValueError(f"Unsafe path in bundle: {p_name}")
+
+		current = p_root
+		for part in parts:
+			current = current / part
+			if current.is_symlink():
+				raise ValueError(f"Bundle path through symlink: {p_name}")
+		return current
+
+	@staticmethod
+	def check_bundle_member(p_root: Path, p_member: tarfile.TarInfo) -> None:
+		if not (p_member.isfile() or p_member.isdir() or p_member.issym() or p_member.islnk()):
+			raise ValueError(f"Unsupported member type in bundle: {p_member.name}")
+
+		pkg_mgr.check_bundle_path(p_root, p_member.name)
+
+		if p_member.islnk():
+			source = pkg_mgr.check_bundle_path(p_root, p_member.linkname)
+			if not source.is_file():
+				raise ValueError(f"Hard link target missing in bundle: {p_member.linkname}")
+
+		if p_member.issym():
+			pkg_mgr.check_bundle_symlink(p_member.name, p_member.linkname)
+
+	def import_bundle(self, p_bundle: Path) -> int:
+		staging_root = self.m_cache_dir / f".import-{os.getpid()}"
+		shutil.rmtree(staging_root, ignore_errors=True)
+		staging_root.mkdir(parents=True)
+
+		try:
+			with tarfile.open(str(p_bundle), 'r|*') as tar_ref:
+				for member in tar_ref:
+					self.check_bundle_member(staging_root, member)
+
+					if member.islnk():
+						target = staging_root / member.name
+						target.parent.mkdir(parents=True, exist_ok=True)
+						shutil.copy2(staging_root / member.linkname, target, follow_symlinks=False)
+						os.chmod(target, member.mode)
+						continue
+
+					tar_ref.extract(member, staging_root)
+
+			names = []
+			for entry in sorted(staging_root.iterdir()):
+				if not (entry / "CACHE" / ".cache").exists():
+					continue
+
+				with file_lock(self.get_lock_file(entry.name)):
+					if (self.m_cache_dir / entry.name).exists():
+						self.clear_pkg(entry.name)
+					os.replace(entry, self.m_cache_dir / entry.name)
+					self.m_cache.forget(entry.name)
+				names.append(entry.name)
+				g_logger.info(f"Imported: {entry.name}")
+		finally:
+			shutil.rmtree(staging_root, ignore_errors=True)
+
+		g_logger.success(f"Imported {len(names)} packages: {p_bundle}")
+		return len(names)
+
 	def __del__(self):
 		if hasattr(self, 'm_executor'):
 			self.m_executor.shutdown(wait=False)
 
 
-def main():
+def build_parser() -> argparse.ArgumentParser:
 	parser = argparse.ArgumentParser()
 	parser.add_argument('--cache-dir', required=True)
 	parser.add_argument('--name', required=True)
@@ -412,25 +1148,56 @@ def main():
 	parser.add_argument('--git-repository')
 	parser.add_argument('--url')
 	parser.add_argument('--keep-updated', action='store_true')
+	parser.add_argument('--update-interval', type=int, default=0)
 	parser.add_argument('--download-only', action='store_true')
+	parser.add_argument('--partial-clone', action='store_true')
+	parser.add_argument('--sparse-dir')
+	parser.add_argument('--submodule-jobs', type=int, default=8)
+	parser.add_argument('--submodule-cache', action='store_true')
 	parser.add_argument('--options', nargs='*')
 	parser.add_argument('--clear-cache', action='store_true')
 	parser.add_argument('--clear-package')
+	parser.add_argument('--export-bundle')
+	parser.add_argument('--import-bundle')
+	parser.add_argument('--report-file')
+	parser.add_argument('--print-report', action='store_true')
+	return parser
+
 
-	args = parser.parse_args()
+def main():
+	args = build_parser().parse_args()
 
-	mgr = pkg_mgr(args.cache_dir)
+	if args.report_file:
+		g_timer.m_report_file = Path(args.report_file)
+		if args.print_report:
+			phase_timer.print_report(g_timer.m_report_file)
+			return
+
+	mgr = pkg_mgr(args.cache_dir, args.submodule_jobs, args.submodule_cache)
 
 	if args.clear_cache:
 		if args.clear_package:
-			mgr.clear_pkg(args.clear_package)
+			with file_lock(mgr.get_lock_file(args.clear_package)):
+				mgr.clear_pkg(args.clear_package)
 		else:
 			shutil.rmtree(args.cache_dir, ignore_errors=True)
 			Path(args.cache_dir).mkdir(parents=True, exist_ok=True)
 		g_logger.info("CLEARED")
 		return
 
-	mgr.process_pkg(args)
+	if args.export_bundle or args.import_bundle:
+		try:
+			if args.export_bundle:
+				mgr.export_bundle(Path(args.export_bundle))
+			else:
+				mgr.import_bundle(Path(args.import_bundle))
+		except (ValueError, tarfile.TarError) as e:
+			g_logger.error(f"Bundle failed: {e}")
+			sys.exit(1)
+		return
+
+	if not mgr.process_pkg(args):
+		sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -1,11 +1,21 @@
 #!/usr/bin/env python3
 
+import os
 import sys
+import shutil
 import subprocess
 import json
+import re
+import fnmatch
 import atexit
 from pathlib import Path
 
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+	import msvcrt
+
 
 CONFIG_PATH = Path.home() / ".config/clang_tidy_cacher/config.json"
 
@@ -15,14 +25,26 @@ DEFAULTS = {
 	"cleanup_threshold": 0.9,
 	"cleanup_target": 0.7,
 	"cleanup_interval": 100,
+	"hot_cache_dir": "",
+	"hot_cache_max_size": 1024 * 1024 * 1024,
+	"hot_cleanup_interval": 1000,
+	"per_check_cache": False,
 }
 
 STATS_DEFAULTS = {
 	"hits": 0,
+	"hot_hits": 0,
 	"misses": 0,
+	"checks_reused": 0,
+	"checks_run": 0,
 	"invocations_since_cleanup": 0,
+	"promotions_since_cleanup": 0,
 }
 
+DIAGNOSTIC_RE = re.compile(r"^(.*?):(\d+):(\d+): (?:warning|error): .* \[([^\]\s]+)\]$")
+LIST_CHECKS_RE = re.compile(r"^\s+(\S+)$")
+BASE_CHECK_PREFIXES = ("clang-diagnostic-", "clang-analyzer-")
+
 VERSION_CACHE = {}
 COMPILE_COMMANDS_CACHE = {}
 
@@ -88,6 +110,11 @@ class configurator:
 	def cache_dir(self):
 		return Path(self.get("cache_dir"))
 
+	@property
+	def hot_cache_dir(self):
+		hot_dir = self.get("hot_cache_dir")
+		return Path(hot_dir) if hot_dir else None
+
 
 def get_clang_tidy_version(clang_tidy_bin):
 	if clang_tidy_bin in VERSION_CACHE:
@@ -193,7 +220,7 @@ def find_clang_tidy_config(source_path, config_file=None):
 	return b""
 
 
-def compute_hash(clang_tidy_bin, source_file, build_path, config_file, extra_args):
+def compute_hash(clang_tidy_bin, source_file, build_path, config_file, extra_args, config=None):
 	import blake3
 
 	hasher = blake3.blake3()
@@ -209,8 +236,8 @@ def compute_hash(clang_tidy_bin, source_file, build_path, config_file, extra_arg
 	preprocessed = get_preprocessor_output(entry, source_file)
 	hasher.update(preprocessed)
 
-	source_path = Path(source_file)
-	config = find_clang_tidy_config(source_path, config_file)
+	if config is None:
+		config = find_clang_tidy_config(Path(source_file), config_file)
 	hasher.update(config)
 
 	for arg in extra_args:
@@ -271,6 +298,56 @@ def get_cache_path(cache_dir, hash_value):
 	return subdir / hash_value
 
 
+def write_cache_file(cache_path, data):
+	tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+	with open(tmp_path, "wb") as file:
+		file.write(data)
+	os.replace(tmp_path, cache_path)
+
+
+def read_cache_entry(cfg, hash_value):
+	hot_dir = cfg.hot_cache_dir
+	if hot_dir is not None:
+		hot_path = hot_dir / hash_value[:2] / hash_value
+		try:
+			with open(hot_path, "rb") as file:
+				data = file.read()
+			os.utime(hot_path)
+			cfg.inc_stat("hot_hits")
+			return json.loads(data)
+		except (OSError, ValueError):
+			pass
+
+	cache_path = cfg.cache_dir / hash_value[:2] / hash_value
+	try:
+		with open(cache_path, "rb") as file:
+			data = file.read()
+	except OSError:
+		return None
+
+	if hot_dir is not None:
+		try:
+			write_cache_file(get_cache_path(hot_dir, hash_value), data)
+			# promotions grow the hot tier, so they count toward the next hot tier cleanup
+			cfg.inc_stat("promotions_since_cleanup")
+		except OSError:
+			pass
+
+	return json.loads(data)
+
+
+def write_cache_entry(cfg, hash_value, cache_data):
+	data = json.dumps(cache_data).encode()
+	write_cache_file(get_cache_path(cfg.cache_dir, hash_value), data)
+
+	hot_dir = cfg.hot_cache_dir
+	if hot_dir is not None:
+		try:
+			write_cache_file(get_cache_path(hot_dir, hash_value), data)
+		except OSError:
+			pass
+
+
 def run_clang_tidy(clang_tidy_bin, args):
 	return subprocess.run(
 		[clang_tidy_bin] + args,
@@ -279,6 +356,210 @@ def run_clang_tidy(clang_tidy_bin, args):
 	)
 
 
+def hash_parts(*parts):
+	import blake3
+
+	hasher = blake3.blake3()
+	for part in parts:
+		hasher.update(part.encode())
+		hasher.update(b"\0")
+	return hasher.hexdigest()
+
+
+def is_checks_arg(arg):
+	return arg.startswith("--checks=") or arg.startswith("-checks=")
+
+
+def split_config(config):
+	try:
+		import yaml
+	except ImportError:
+		return None
+
+	try:
+		data = yaml.safe_load(config) if config else {}
+	except yaml.YAMLError:
+		return None
+
+	if not isinstance(data, dict):
+		return None
+
+	raw_options = data.get("CheckOptions") or {}
+	if isinstance(raw_options, list):
+		options = {item["key"]: str(item["value"]) for item in raw_options if "key" in item}
+	elif isinstance(raw_options, dict):
+		options = {key: str(value) for key, value in raw_options.items()}
+	else:
+		return None
+
+	raw_checks = data.get("Checks") or ""
+	if isinstance(raw_checks, list):
+		raw_checks = ",".join(str(item) for item in raw_checks)
+	globs = [glob.strip() for glob in str(raw_checks).split(",") if glob.strip()]
+
+	base = {key: value for key, value in data.items() if key not in ("Checks", "CheckOptions")}
+	return base, options, globs
+
+
+def is_base_glob(glob):
+	pattern = glob.lstrip("-")
+	for prefix in BASE_CHECK_PREFIXES:
+		if pattern.startswith(prefix) or fnmatch.fnmatchcase(prefix + "x", pattern):
+			return True
+	return False
+
+
+def list_enabled_checks(cfg, clang_tidy_bin, args, config):
+	flags = [arg for arg in args if arg.startswith("-")]
+	list_hash = hash_parts("list-checks", get_clang_tidy_version(clang_tidy_bin), config.decode(errors="replace"), *flags)
+
+	cached = read_cache_entry(cfg, list_hash)
+	if cached is not None:
+		return cached["checks"]
+
+	result = run_clang_tidy(clang_tidy_bin, ["--list-checks"] + args)
+	if result.returncode != 0:
+		return None
+
+	checks = []
+	for line in result.stdout.splitlines():
+		match = LIST_CHECKS_RE.match(line)
+		if match:
+			checks.append(match.group(1))
+
+	if not checks:
+		return None
+
+	write_cache_entry(cfg, list_hash, {"checks": checks})
+	return checks
+
+
+def split_diagnostics(output):
+	blocks = []
+	current = None
+
+	for line in output.splitlines(keepends=True):
+		match = DIAGNOSTIC_RE.match(line.rstrip("\n"))
+		if match:
+			checks = [name for name in match.group(4).split(",") if not name.startswith("-")]
+			current = {"checks": checks, "text": line}
+			blocks.append(current)
+		elif current is not None:
+			current["text"] += line
+		else:
+			current = {"checks": [], "text": line}
+			blocks.append(current)
+
+	return blocks
+
+
+def block_sort_key(text):
+	match = DIAGNOSTIC_RE.match(text.split("\n", 1)[0])
+	if match is None:
+		return ("", 0, 0)
+	return (match.group(1), int(match.group(2)), int(match.group(3)))
+
+
+def block_is_error(text):
+	return ": error: " in text.split("\n", 1)[0]
+
+
+def restrict_checks(args, checks):
+	restricted = "--checks=-*," + ",".join(checks)
+	result = [restricted if is_checks_arg(arg) else arg for arg in args]
+	if restricted not in result:
+		result.append(restricted)
+	return result
+
+
+def run_per_check(cfg, clang_tidy_bin, args, source_file, build_path, config_file, extra_args):
+	config = find_clang_tidy_config(Path(source_file), config_file)
+	parts = split_config(config)
+	if parts is None:
+		return None
+
+	base, options, globs = parts
+	for arg in extra_args:
+		if is_checks_arg(arg):
+			globs.extend(glob.strip() for glob in arg.split("=", 1)[1].split(","))
+
+	checks = list_enabled_checks(cfg, clang_tidy_bin, args, config)
+	if checks is None:
+		return None
+
+	check_set = set(checks)
+	global_options = {key: value for key, value in options.items() if key.rsplit(".", 1)[0] not in check_set}
+	# clang-diagnostic-* and clang-analyzer-* globs decide what the diagnostics entry holds
+	base_globs = [glob for glob in globs if is_base_glob(glob)]
+	base_config = json.dumps([base, global_options, base_globs], sort_keys=True).encode()
+	base_args = [arg for arg in extra_args if not is_checks_arg(arg)]
+	base_hash = compute_hash(clang_tidy_bin, source_file, build_path, config_file, base_args, base_config)
+
+	def check_hash(check):
+		check_options = {key: value for key, value in options.items() if key.rsplit(".", 1)[0] == check}
+		return hash_parts(base_hash, check, json.dumps(check_options, sort_keys=True))
+
+	check_hashes = {check: check_hash(check) for check in checks}
+	diag_hash = hash_parts(base_hash, "<diagnostics>")
+
+	entries = {check: read_cache_entry(cfg, value) for check, value in check_hashes.items()}
+	diag_entry = read_cache_entry(cfg, diag_hash)
+	missing = [check for check in checks if entries[check] is None]
+
+	stderr = ""
+	if missing or diag_entry is None:
+		# compiler diagnostics only appear when the full check set runs
+		full_run = diag_entry is None or len(missing) == len(checks)
+		run_checks = checks if full_run else missing
+		run_args = args if full_run else restrict_checks(args, run_checks)
+		result = run_clang_tidy(clang_tidy_bin, run_args)
+		stderr = result.stderr
+
+		blocks = split_diagnostics(result.stdout)
+		errors = [block for block in blocks if block_is_error(block["text"])]
+		if result.returncode != 0 and not errors:
+			return result
+
+		run_set = set(run_checks)
+		new_entries = {check: {"blocks": [], "error": False} for check in run_checks}
+		run_diag_entry = {"blocks": [], "error": False}
+
+		for block in blocks:
+			owners = [check for check in block["checks"] if check in run_set]
+			targets = [new_entries[check] for check in owners] if owners else [run_diag_entry]
+			for target in targets:
+				target["blocks"].append(block["text"])
+				target["error"] = target["error"] or block_is_error(block["text"])
+
+		for check, entry in new_entries.items():
+			write_cache_entry(cfg, check_hashes[check], entry)
+			entries[check] = entry
+
+		if full_run:
+			diag_entry = run_diag_entry
+			write_cache_entry(cfg, diag_hash, diag_entry)
+
+		cfg.inc_stat("misses")
+		cfg.inc_stat("checks_run", len(run_checks))
+		cfg.inc_stat("checks_reused", len(checks) - len(run_checks))
+		cfg.inc_stat("invocations_since_cleanup")
+	else:
+		cfg.inc_stat("hits")
+		cfg.inc_stat("checks_reused", len(checks))
+
+	merged = []
+	seen = set()
+	for entry in [diag_entry] + [entries[check] for check in checks]:
+		for text in entry["blocks"]:
+			if text not in seen:
+				seen.add(text)
+				merged.append(text)
+	merged.sort(key=block_sort_key)
+
+	has_error = diag_entry["error"] or any(entries[check]["error"] for check in checks)
+	return subprocess.CompletedProcess(args, 1 if has_error else 0, "".join(merged), stderr)
+
+
 def get_cache_size(cache_dir):
 	if not cache_dir.exists():
 		return 0
@@ -293,13 +574,11 @@ def get_cache_size(cache_dir):
 	return total
 
 
-def cleanup_cache(cfg):
-	cache_dir = cfg.cache_dir
+def evict_dir(cache_dir, max_size, threshold_ratio, target_ratio, demote_dir=None):
 	if not cache_dir.exists():
 		return
 
-	max_size = cfg.get("max_cache_size")
-	threshold = max_size * cfg.get("cleanup_threshold")
+	threshold = max_size * threshold_ratio
 
 	files = []
 	total_size = 0
@@ -313,26 +592,117 @@ def cleanup_cache(cfg):
 					total_size += stat.st_size
 
 	if total_size <= threshold:
-		cfg.set_stat("invocations_since_cleanup", 0)
 		return
 
-	target_size = int(max_size * cfg.get("cleanup_target"))
+	target_size = int(max_size * target_ratio)
 	files.sort(key=lambda x: x[1])
 
 	for file, _, size in files:
 		if total_size <= target_size:
 			break
+
+		if demote_dir is not None:
+			demote_path = demote_dir / file.parent.name / file.name
+			if not demote_path.exists():
+				demote_path.parent.mkdir(parents=True, exist_ok=True)
+				shutil.move(file, demote_path)
+				total_size -= size
+				continue
+
 		file.unlink(missing_ok=True)
 		total_size -= size
 
-	cfg.set_stat("invocations_since_cleanup", 0)
+
+def cleanup_cache(cfg):
+	evict_dir(
+		cfg.cache_dir,
+		cfg.get("max_cache_size"),
+		cfg.get("cleanup_threshold"),
+		cfg.get("cleanup_target")
+	)
+	cleanup_hot_cache(cfg)
+
+
+def cleanup_hot_cache(cfg):
+	if cfg.hot_cache_dir is not None:
+		evict_dir(
+			cfg.hot_cache_dir,
+			cfg.get("hot_cache_max_size"),
+			cfg.get("cleanup_threshold"),
+			cfg.get("cleanup_target"),
+			demote_dir=cfg.cache_dir
+		)
+
+
+def try_lock(lock_path):
+	lock_path.parent.mkdir(parents=True, exist_ok=True)
+	file = open(lock_path, "a+b")
+
+	try:
+		if fcntl is not None:
+			fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+		else:
+			file.seek(0)
+			msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+	except OSError:
+		file.close()
+		return None
+
+	return file
+
+
+def run_cleanup(cfg, hot_only=False):
+	lock = try_lock(cfg.cache_dir / ".cleanup.lock")
+	if lock is None:
+		return
+
+	try:
+		if hot_only:
+			cleanup_hot_cache(cfg)
+		else:
+			cleanup_cache(cfg)
+	finally:
+		lock.close()
+
+
+def maybe_cleanup(cfg):
+	if cfg.get_stat("invocations_since_cleanup") >= cfg.get("cleanup_interval"):
+		cfg.set_stat("invocations_since_cleanup", 0)
+		cfg.set_stat("promotions_since_cleanup", 0)
+		spawn_cleanup()
+	elif cfg.get_stat("promotions_since_cleanup") >= cfg.get("hot_cleanup_interval"):
+		cfg.set_stat("promotions_since_cleanup", 0)
+		spawn_cleanup("--cleanup-hot")
+
+
+def spawn_cleanup(command="--cleanup"):
+	kwargs = {}
+	if os.name == "nt":
+		kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+	else:
+		kwargs["start_new_session"] = True
+
+	try:
+		subprocess.Popen(
+			[sys.executable, str(Path(__file__).resolve()), command],
+			stdin=subprocess.DEVNULL,
+			stdout=subprocess.DEVNULL,
+			stderr=subprocess.DEVNULL,
+			close_fds=True,
+			**kwargs
+		)
+	except OSError:
+		pass
 
 
 def print_stats(cfg):
 	print(f"Cache directory: {cfg.cache_dir}")
 	print(f"Max cache size: {cfg.get('max_cache_size') / (1024**3):.2f} GB")
 	print(f"Hits: {cfg.get_stat('hits')}")
+	print(f"Hot hits: {cfg.get_stat('hot_hits')}")
 	print(f"Misses: {cfg.get_stat('misses')}")
+	print(f"Checks reused: {cfg.get_stat('checks_reused')}")
+	print(f"Checks run: {cfg.get_stat('checks_run')}")
 
 	total = cfg.get_stat("hits") + cfg.get_stat("misses")
 	if total > 0:
@@ -348,6 +718,12 @@ def print_stats(cfg):
 		print(f"Current size: {size / (1024**2):.2f} MB")
 		print(f"Cached entries: {count}")
 
+	hot_dir = cfg.hot_cache_dir
+	if hot_dir is not None:
+		print(f"Hot cache directory: {hot_dir}")
+		print(f"Hot max size: {cfg.get('hot_cache_max_size') / (1024**2):.2f} MB")
+		print(f"Hot size: {get_cache_size(hot_dir) / (1024**2):.2f} MB")
+
 
 def handle_cli():
 	if len(sys.argv) < 2:
@@ -359,17 +735,28 @@ def handle_cli():
 		print_stats(configurator())
 		return True
 
+	if cmd == "--cleanup":
+		run_cleanup(configurator())
+		return True
+
+	if cmd == "--cleanup-hot":
+		run_cleanup(configurator(), hot_only=True)
+		return True
+
 	if cmd == "--clear":
 		cfg = configurator()
-		if cfg.cache_dir.exists():
-			for subdir in cfg.cache_dir.iterdir():
+		for cache_dir in (cfg.cache_dir, cfg.hot_cache_dir):
+			if cache_dir is None or not cache_dir.exists():
+				continue
+			for subdir in cache_dir.iterdir():
 				if subdir.is_dir():
 					for file in subdir.iterdir():
 						if file.is_file():
 							file.unlink()
 					subdir.rmdir()
-			print("Cache cleared")
+			print(f"Cache cleared: {cache_dir}")
 		cfg.set_stat("hits", 0)
+		cfg.set_stat("hot_hits", 0)
 		cfg.set_stat("misses", 0)
 		return True
 
@@ -404,6 +791,8 @@ def handle_cli():
 		print("Commands:")
 		print("  --stats          Show cache statistics")
 		print("  --clear          Clear cache and reset stats")
+		print("  --cleanup        Evict old entries now (normally run in the background)")
+		print("  --cleanup-hot    Evict old entries from the hot tier only")
 		print("  --config         Show all config")
 		print("  --config <key>   Get config value")
 		print("  --config <key> <value>  Set config value")
@@ -414,6 +803,10 @@ def handle_cli():
 		print("  cleanup_threshold  Start cleanup at this ratio (default: 0.9)")
 		print("  cleanup_target   Target ratio after cleanup (default: 0.7)")
 		print("  cleanup_interval Check cleanup every N misses (default: 100)")
+		print("  hot_cache_dir    Fast tier in front of cache_dir, e.g. /dev/shm/clang_tidy_cache (default: off)")
+		print("  hot_cache_max_size  Max hot tier size in bytes (default: 1GB)")
+		print("  hot_cleanup_interval  Check hot tier cleanup every N promotions (default: 1000)")
+		print("  per_check_cache  Cache results per check so config edits only rerun changed checks (default: 0)")
 		return True
 
 	return False
@@ -440,17 +833,23 @@ def main():
 		print(result.stderr, end="", file=sys.stderr)
 		return result.returncode
 
+	if cfg.get("per_check_cache"):
+		result = run_per_check(cfg, clang_tidy_bin, args, source_file, build_path, config_file, extra_args)
+		if result is not None:
+			maybe_cleanup(cfg)
+
+			print(result.stdout, end="")
+			print(result.stderr, end="", file=sys.stderr)
+			return result.returncode
+
 	hash_value = compute_hash(clang_tidy_bin, source_file, build_path, config_file, extra_args)
-	cache_dir = cfg.cache_dir
-	cache_dir.mkdir(parents=True, exist_ok=True)
-	cache_path = get_cache_path(cache_dir, hash_value)
+	cached = read_cache_entry(cfg, hash_value)
 
-	if cache_path.exists():
-		with open(cache_path, "rb") as file:
-			cached = json.load(file)
+	if cached is not None:
 		print(cached.get("stdout", ""), end="")
 		print(cached.get("stderr", ""), end="", file=sys.stderr)
 		cfg.inc_stat("hits")
+		maybe_cleanup(cfg)
 		return cached.get("returncode", 0)
 
 	cfg.inc_stat("misses")
@@ -462,13 +861,10 @@ def main():
 			"stderr": result.stderr,
 			"returncode": result.returncode
 		}
-		with open(cache_path, "w") as file:
-			json.dump(cache_data, file)
+		write_cache_entry(cfg, hash_value, cache_data)
 
 	cfg.inc_stat("invocations_since_cleanup")
-
-	if cfg.get_stat("invocations_since_cleanup") >= cfg.get("cleanup_interval"):
-		cleanup_cache(cfg)
+	maybe_cleanup(cfg)
 
 	print(result.stdout, end="")
 	print(result.stderr, end="", file=sys.stderr)
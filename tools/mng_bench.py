@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+import argparse
+import functools
+import http.server
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import mng_impl
+
+
+GIT_ENV = {
+	'GIT_AUTHOR_NAME': 'mng-bench',
+	'GIT_AUTHOR_EMAIL': 'mng-bench@localhost',
+	'GIT_COMMITTER_NAME': 'mng-bench',
+	'GIT_COMMITTER_EMAIL': 'mng-bench@localhost',
+	'GIT_CONFIG_COUNT': '1',
+	'GIT_CONFIG_KEY_0': 'protocol.file.allow',
+	'GIT_CONFIG_VALUE_0': 'always',
+}
+
+
+class fixture_gen:
+	def __init__(self, p_root: Path, p_files: int, p_file_sz: int):
+		self.m_root = p_root
+		self.m_files = p_files
+		self.m_file_sz = p_file_sz
+		self.m_serve_dir = p_root / "serve"
+		self.m_git_dir = p_root / "git"
+		self.m_serve_dir.mkdir(parents=True, exist_ok=True)
+		self.m_git_dir.mkdir(parents=True, exist_ok=True)
+
+	@staticmethod
+	def git(p_args: List[str], p_cwd: Optional[Path] = None) -> None:
+		subprocess.run(['git'] + p_args, cwd=p_cwd, check=True, capture_output=True)
+
+	def fill_tree(self, p_dir: Path, p_seed: str) -> None:
+		for idx_for in range(self.m_files):
+			target = p_dir / f"d{idx_for % 16:02d}" / f"f{idx_for:05d}.txt"
+			target.parent.mkdir(parents=True, exist_ok=True)
+			line = f"{p_seed}:{idx_for}\n".encode()
+			target.write_bytes((line * (self.m_file_sz // len(line) + 1))[:self.m_file_sz])
+
+	def make_repo(self, p_name: str, p_submodules: Optional[List[str]] = None) -> str:
+		bare = self.m_git_dir / f"{p_name}.git"
+		work = self.m_git_dir / f"{p_name}.work"
+		shutil.rmtree(bare, ignore_errors=True)
+		shutil.rmtree(work, ignore_errors=True)
+
+		self.git(['init', '--quiet', '--bare', str(bare)])
+		self.git(['init', '--quiet', str(work)])
+		self.fill_tree(work, p_name)
+
+		for sub_name in p_submodules or []:
+			sub_url = (self.m_git_dir / f"{sub_name}.git").as_uri()
+			self.git(['submodule', 'add', '--quiet', sub_url, f"ext/{sub_name}"], work)
+
+		self.git(['add', '-A'], work)
+		self.git(['commit', '--quiet', '-m', p_name], work)
+		self.git(['push', '--quiet', str(bare), 'HEAD:refs/heads/main'], work)
+		self.git(['symbolic-ref', 'HEAD', 'refs/heads/main'], bare)
+		shutil.rmtree(work)
+		return bare.as_uri()
+
+	def make_archive(self, p_name: str, p_fmt: str) -> str:
+		src = self.m_root / "archive_src" / p_name
+		shutil.rmtree(src.parent, ignore_errors=True)
+		self.fill_tree(src / "src", p_name)
+
+		if p_fmt == 'zip':
+			out = self.m_serve_dir / f"{p_name}.zip"
+			with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+				for file in sorted(src.rglob('*')):
+					zip_ref.write(file, file.relative_to(src.parent).as_posix())
+		else:
+			out = self.m_serve_dir / f"{p_name}.tar.gz"
+			with tarfile.open(out, 'w:gz') as tar_ref:
+				tar_ref.add(src, arcname=p_name)
+
+		shutil.rmtree(src.parent)
+		return out.name
+
+
+class quiet_handler(http.server.SimpleHTTPRequestHandler):
+	def log_message(self, p_format, *p_args):
+		pass
+
+
+class http_fixture:
+	def __init__(self, p_dir: Path):
+		handler = functools.partial(quiet_handler, directory=str(p_dir))
+		self.m_server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+		self.m_thread = threading.Thread(target=self.m_server.serve_forever, daemon=True)
+
+	@property
+	def base_url(self) -> str:
+		host, port = self.m_server.server_address[:2]
+		return f"http://{host}:{port}"
+
+	def __enter__(self):
+		self.m_thread.start()
+		return self
+
+	def __exit__(self, p_type, p_value, p_tb):
+		self.m_server.shutdown()
+		self.m_server.server_close()
+
+
+class bench_runner:
+	def __init__(self, p_work_dir: Path, p_repeat: int):
+		self.m_work_dir = p_work_dir
+		self.m_repeat = p_repeat
+		self.m_results = []
+		self.m_parser = mng_impl.build_parser()
+
+	def make_args(self, p_cache_dir: Path, p_name: str, p_source: Dict[str, str], p_extra: Optional[List[str]] = None):
+		argv = ['--cache-dir', str(p_cache_dir), '--name', p_name]
+		for key, value in p_source.items():
+			argv.extend([f"--{key.replace('_', '-')}", value])
+		return self.m_parser.parse_args(argv + (p_extra or []))
+
+	def fresh_cache(self) -> Path:
+		return Path(tempfile.mkdtemp(prefix="cache-", dir=self.m_work_dir))
+
+	def measure(self, p_scenario: str, p_source: str, p_setup: Callable[[], object], p_run: Callable[[object], bool], p_count: int = 1) -> None:
+		samples = []
+		for _ in range(self.m_repeat):
+			state = p_setup()
+			start = time.perf_counter()
+			ok = p_run(state)
+			samples.append(time.perf_counter() - start)
+			if not ok:
+				raise RuntimeError(f"{p_scenario}/{p_source} failed")
+
+		entry = {
+			'scenario': p_scenario,
+			'source': p_source,
+			'packages': p_count,
+			'samples': samples,
+			'min': min(samples),
+			'median': statistics.median(samples),
+			'mean': statistics.fmean(samples),
+		}
+		self.m_results.append(entry)
+		print(f"{p_scenario:<20} {p_source:<16} median {entry['median'] * 1000:9.1f} ms", flush=True)
+
+	def bench_source(self, p_label: str, p_source: Dict[str, str], p_is_git: bool) -> None:
+		name = p_label
+
+		def populated_setup():
+			cache_dir = self.fresh_cache()
+			if not mng_impl.pkg_mgr(cache_dir).process_pkg(self.make_args(cache_dir, name, p_source)):
+				raise RuntimeError(f"populating {p_label} failed")
+			return cache_dir
+
+		def run_plain(p_cache_dir):
+			return mng_impl.pkg_mgr(p_cache_dir).process_pkg(self.make_args(p_cache_dir, name, p_source))
+
+		def run_refetch(p_cache_dir):
+			# a changed identity key forces clear + fetch; 'main' is a valid branch for --branch
+			bump = ['--git-tag', 'main'] if p_is_git else ['--version', 'bench-bump']
+			args = self.make_args(p_cache_dir, name, p_source, bump)
+			return mng_impl.pkg_mgr(p_cache_dir).process_pkg(args)
+
+		self.measure('cold_fetch', p_label, self.fresh_cache, run_plain)
+		self.measure('cache_hit', p_label, populated_setup, run_plain)
+
+		if p_is_git:
+			def run_keep_updated(p_cache_dir):
+				args = self.make_args(p_cache_dir, name, p_source, ['--keep-updated', '--update-interval', '0'])
+				return mng_impl.pkg_mgr(p_cache_dir).process_pkg(args)
+
+			self.measure('keep_updated_noop', p_label, populated_setup, run_keep_updated)
+
+		self.measure('refetch', p_label, populated_setup, run_refetch)
+
+	def bench_batch(self, p_label: str, p_sources: List[Dict[str, str]]) -> None:
+		def run_batch(p_cache_dir):
+			mgr = mng_impl.pkg_mgr(p_cache_dir)
+			ok = True
+			for idx_for, source in enumerate(p_sources):
+				ok = mgr.process_pkg(self.make_args(p_cache_dir, f"batch{idx_for}", source)) and ok
+			return ok
+
+		def populated_setup():
+			cache_dir = self.fresh_cache()
+			if not run_batch(cache_dir):
+				raise RuntimeError(f"populating batch {p_label} failed")
+			return cache_dir
+
+		self.measure('batch_cold', p_label, self.fresh_cache, run_batch, len(p_sources))
+		self.measure('batch_cache_hit', p_label, populated_setup, run_batch, len(p_sources))
+
+
+def git_rev() -> str:
+	result = subprocess.run(
+		['git', 'rev-parse', '--short', 'HEAD'],
+		cwd=Path(__file__).resolve().parent, capture_output=True, text=True
+	)
+	return result.stdout.strip() if result.returncode == 0 else ''
+
+
+def compare(p_base: Path, p_new: Path) -> int:
+	with open(p_base, 'r') as f:
+		base = json.load(f)
+	with open(p_new, 'r') as f:
+		new = json.load(f)
+
+	base_idx = {(r['scenario'], r['source']): r for r in base['results']}
+
+	print(f"{'scenario':<20} {'source':<16} {'base ms':>10} {'new ms':>10} {'ratio':>7}")
+	for entry in new['results']:
+		key = (entry['scenario'], entry['source'])
+		if key not in base_idx:
+			continue
+		base_ms = base_idx[key]['median'] * 1000
+		new_ms = entry['median'] * 1000
+		ratio = new_ms / base_ms if base_ms > 0 else float('inf')
+		print(f"{key[0]:<20} {key[1]:<16} {base_ms:10.1f} {new_ms:10.1f} {ratio:7.2f}")
+	return 0
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(description="Offline benchmark for mng_impl fetch, extract and cache paths")
+	parser.add_argument('--output', default='bench_output.json')
+	parser.add_argument('--work-dir')
+	parser.add_argument('--files', type=int, default=200)
+	parser.add_argument('--file-size', type=int, default=4096)
+	parser.add_argument('--submodules', type=int, default=3)
+	parser.add_argument('--batch', type=int, default=10)
+	parser.add_argument('--repeat', type=int, default=3)
+	parser.add_argument('--keep', action='store_true')
+	parser.add_argument('--verbose', action='store_true')
+	parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'))
+	args = parser.parse_args()
+
+	if args.compare:
+		return compare(Path(args.compare[0]), Path(args.compare[1]))
+
+	os.environ.update(GIT_ENV)
+	mng_impl.g_logger.m_level = "INFO" if args.verbose else "QUIET"
+	work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="mng-bench-"))
+	work_dir.mkdir(parents=True, exist_ok=True)
+
+	try:
+		gen = fixture_gen(work_dir / "fixtures", args.files, args.file_size)
+		sub_names = [f"sub{idx_for}" for idx_for in range(args.submodules)]
+		for sub_name in sub_names:
+			gen.make_repo(sub_name)
+
+		plain_url = gen.make_repo("plain")
+		super_url = gen.make_repo("super", sub_names)
+		tar_name = gen.make_archive("archive", 'tar')
+		zip_name = gen.make_archive("archive", 'zip')
+		batch_names = [gen.make_archive(f"batch{idx_for}", 'tar') for idx_for in range(args.batch)]
+
+		runner = bench_runner(work_dir, args.repeat)
+
+		with http_fixture(gen.m_serve_dir) as server:
+			runner.bench_source('git_file', {'git_repository': plain_url}, True)
+			runner.bench_source('git_submodules', {'git_repository': super_url}, True)
+			runner.bench_source('tar_file', {'url': (gen.m_serve_dir / tar_name).as_uri()}, False)
+			runner.bench_source('zip_file', {'url': (gen.m_serve_dir / zip_name).as_uri()}, False)
+			runner.bench_source('tar_http', {'url': f"{server.base_url}/{tar_name}"}, False)
+			runner.bench_source('zip_http', {'url': f"{server.base_url}/{zip_name}"}, False)
+			runner.bench_batch('tar_http', [{'url': f"{server.base_url}/{name}"} for name in batch_names])
+
+		report = {
+			'meta': {
+				'commit': git_rev(),
+				'timestamp': time.time(),
+				'python': platform.python_version(),
+				'platform': platform.platform(),
+				'params': {
+					'files': args.files,
+					'file_size': args.file_size,
+					'submodules': args.submodules,
+					'batch': args.batch,
+					'repeat': args.repeat,
+				},
+			},
+			'results': runner.m_results,
+		}
+
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=2)
+		print(f"Results: {args.output}")
+		return 0
+	finally:
+		if not args.keep:
+			shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+	sys.exit(main())